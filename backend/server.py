@@ -1,30 +1,60 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient
+from gridfs import AsyncGridFSBucket
+from gridfs.errors import NoFile
+from bson import ObjectId
+from bson.errors import InvalidId
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 import os
+import asyncio
 import logging
 import uuid
-import json
+import time
+import re
+import hashlib
 import io
 import csv
 import tempfile
 import base64
+import binascii
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import httpx
+import orjson
+
+try:
+    from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
+except ImportError:
+    LlmChat = UserMessage = ImageContent = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncMongoClient(
+    mongo_url, minPoolSize=5, maxPoolSize=50, maxIdleTimeMS=60000, serverSelectionTimeoutMS=5000
+)
 db = client[os.environ['DB_NAME']]
+db_fs = AsyncGridFSBucket(db)
+
+redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Short timeouts so an unreachable Redis degrades to Mongo instead of stalling requests
+redis_client = Redis.from_url(
+    redis_url, decode_responses=True, socket_connect_timeout=0.3, socket_timeout=0.3
+)
 
-app = FastAPI()
+http_client = httpx.AsyncClient(
+    timeout=10.0, limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -38,6 +68,35 @@ DEFAULT_CATEGORIES = [
     "Gifts & Donations", "Insurance", "Miscellaneous"
 ]
 
+SESSION_LIFETIME = timedelta(days=7)
+# Cached sessions are short-lived so a lost invalidation can only go stale briefly
+SESSION_CACHE_TTL = 300
+# Outlives any cache entry written by a request that raced the logout
+SESSION_REVOKED_TTL = 2 * SESSION_CACHE_TTL
+# User fields copied onto each session so authenticating needs only the session lookup
+SESSION_USER_FIELDS = ("user_id", "email", "name", "picture", "currency", "theme", "auth_provider")
+RECEIPT_COUNT_TTL = 30
+MAX_IMAGE_BASE64_LENGTH = 8 * 1024 * 1024
+
+OCR_SYSTEM_PROMPT = (
+    "You are a receipt OCR assistant. Extract data from receipt images and return ONLY valid JSON. "
+    "Extract: merchant_name (string), date (YYYY-MM-DD string), total (number), "
+    "tax (number, GST/HST if visible), items (array of {name: string, price: number}), "
+    "payment_method (string like 'Visa', 'Cash', 'Debit', etc). "
+    "If a field is not visible, use empty string for strings, 0 for numbers, empty array for items. "
+    "Return ONLY the JSON object, no markdown, no explanation."
+)
+# Markdown code fence the model sometimes wraps its JSON in
+_FENCE_RE = re.compile(r"\A```(?:json)?\s*|\s*```\Z", re.IGNORECASE)
+RECEIPT_LIST_PROJECTION = {
+    "_id": 0, "receipt_id": 1, "merchant_name": 1, "date": 1, "total": 1, "tax": 1,
+    "section": 1, "category_id": 1, "payment_method": 1, "image_id": 1, "created_at": 1
+}
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+
+# Checked against on unknown emails so login takes the same time either way
+_DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
 # ============= PYDANTIC MODELS =============
 class UserRegister(BaseModel):
     email: str
@@ -88,14 +147,152 @@ class UserSettingsUpdate(BaseModel):
     currency: Optional[str] = None
     theme: Optional[str] = None
 
+# ============= SESSION CACHE =============
+REDIS_WARNING_INTERVAL = 60
+_last_redis_warning = 0.0
+
+
+def log_cache_error(action: str, e: RedisError):
+    """Warn about Redis failures at most once a minute; repeats go to debug."""
+    global _last_redis_warning
+    now = time.monotonic()
+    if now - _last_redis_warning >= REDIS_WARNING_INTERVAL:
+        _last_redis_warning = now
+        logger.warning(f"{action} failed: {e}")
+    else:
+        logger.debug(f"{action} failed: {e}")
+
+
+def session_user(user: dict) -> dict:
+    return {f: user.get(f, "") for f in SESSION_USER_FIELDS}
+
+
+def _session_key(token: str) -> str:
+    return f"sess:{token}"
+
+
+def _user_sessions_key(user_id: str) -> str:
+    return f"sess_by_user:{user_id}"
+
+
+def _revoked_key(token: str) -> str:
+    return f"sess_revoked:{token}"
+
+
+async def get_cached_session(token: str):
+    """Return (cached payload or None, whether the token was revoked by logout)."""
+    try:
+        cached, revoked = await redis_client.mget(_session_key(token), _revoked_key(token))
+    except RedisError as e:
+        log_cache_error("Session cache read", e)
+        return None, False
+    return (orjson.loads(cached) if cached else None), bool(revoked)
+
+
+async def cache_session(token: str, user_id: str, expires_at: datetime, user: dict):
+    remaining = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+    ttl_seconds = min(remaining, SESSION_CACHE_TTL)
+    if ttl_seconds <= 0:
+        return
+    payload = {
+        "user_id": user_id,
+        "expires_at": expires_at.isoformat(),
+        "user": session_user(user)
+    }
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(_session_key(token), orjson.dumps(payload, default=str), ex=ttl_seconds)
+            pipe.sadd(_user_sessions_key(user_id), token)
+            pipe.expire(_user_sessions_key(user_id), SESSION_CACHE_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        log_cache_error("Session cache write", e)
+
+
+async def revoke_session(token: str):
+    """Drop the cached session and leave a tombstone; RedisError propagates to the caller."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(_revoked_key(token), 1, ex=SESSION_REVOKED_TTL)
+        pipe.delete(_session_key(token))
+        await pipe.execute()
+
+
+async def invalidate_user_sessions(user_id: str):
+    try:
+        tokens = await redis_client.smembers(_user_sessions_key(user_id))
+        keys = [_session_key(t) for t in tokens] + [_user_sessions_key(user_id)]
+        await redis_client.delete(*keys)
+    except RedisError as e:
+        log_cache_error("Session cache invalidation", e)
+
+
+# ============= RECEIPT COUNT CACHE =============
+def _receipt_count_keys(user_id: str) -> str:
+    return f"rcpt_count_keys:{user_id}"
+
+
+async def get_receipt_count(user_id: str, query: dict) -> int:
+    query_hash = hashlib.blake2b(orjson.dumps(query, option=orjson.OPT_SORT_KEYS, default=str), digest_size=8).hexdigest()
+    key = f"rcpt_count:{user_id}:{query_hash}"
+    try:
+        cached = await redis_client.get(key)
+        if cached is not None:
+            return int(cached)
+    except RedisError as e:
+        log_cache_error("Receipt count cache read", e)
+
+    if query == {"user_id": user_id}:
+        count = await db.receipts.count_documents(query, hint=[("user_id", 1), ("date", -1)])
+    else:
+        count = await db.receipts.count_documents(query)
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, RECEIPT_COUNT_TTL, count)
+            pipe.sadd(_receipt_count_keys(user_id), key)
+            pipe.expire(_receipt_count_keys(user_id), RECEIPT_COUNT_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        log_cache_error("Receipt count cache write", e)
+    return count
+
+
+async def invalidate_receipt_counts(user_id: str):
+    try:
+        keys = await redis_client.smembers(_receipt_count_keys(user_id))
+        await redis_client.delete(*keys, _receipt_count_keys(user_id))
+    except RedisError as e:
+        log_cache_error("Receipt count cache invalidation", e)
+
+
 # ============= AUTH HELPERS =============
+# bcrypt releases the GIL, so running it in a worker thread keeps the event loop free
+async def hash_password(password: str) -> str:
+    hashed = await asyncio.to_thread(bcrypt.hashpw, password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS))
+    return hashed.decode()
+
+
+async def check_password(password: str, hashed: str) -> bool:
+    return await asyncio.to_thread(bcrypt.checkpw, password.encode(), hashed.encode())
+
+
 async def get_current_user(request: Request):
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
     token = auth_header.split("Bearer ")[1]
-    session = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
+    cached, revoked = await get_cached_session(token)
+    if revoked:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    if cached:
+        if datetime.fromisoformat(cached["expires_at"]) < datetime.now(timezone.utc):
+            raise HTTPException(status_code=401, detail="Session expired")
+        return cached["user"]
+
+    session = await db.user_sessions.find_one(
+        {"session_token": token}, {"_id": 0, "user_id": 1, "expires_at": 1, "user": 1}
+    )
     if not session:
         raise HTTPException(status_code=401, detail="Invalid session")
 
@@ -107,39 +304,83 @@ async def get_current_user(request: Request):
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
 
-    user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
+    user = session.get("user")
     if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+        # Sessions created before user fields were denormalized onto them
+        user = await db.users.find_one(
+            {"user_id": session["user_id"]}, {"_id": 0, **{f: 1 for f in SESSION_USER_FIELDS}}
+        )
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
 
-    safe_user = {k: v for k, v in user.items() if k != "password_hash"}
+    safe_user = session_user(user)
+    await cache_session(token, session["user_id"], expires_at, safe_user)
     return safe_user
 
 
-async def create_session(user_id: str):
+async def create_session(user_id: str, user: dict):
     token = f"sess_{uuid.uuid4().hex}"
+    now = datetime.now(timezone.utc)
+    expires_at = now + SESSION_LIFETIME
     await db.user_sessions.insert_one({
         "session_token": token,
         "user_id": user_id,
-        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
-        "created_at": datetime.now(timezone.utc)
+        "user": session_user(user),
+        "expires_at": expires_at,
+        "created_at": now
     })
+    await cache_session(token, user_id, expires_at, user)
     return token
 
 
+async def refresh_user_sessions(user: dict):
+    await db.user_sessions.update_many(
+        {"user_id": user["user_id"]}, {"$set": {"user": session_user(user)}}
+    )
+    await invalidate_user_sessions(user["user_id"])
+
+
 async def seed_default_categories(user_id: str):
-    categories = []
-    for section in ["personal", "business"]:
-        for name in DEFAULT_CATEGORIES:
-            categories.append({
-                "category_id": f"cat_{uuid.uuid4().hex[:12]}",
-                "user_id": user_id,
-                "name": name,
-                "section": section,
-                "is_default": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
-    if categories:
-        await db.categories.insert_many(categories)
+    now_iso = datetime.now(timezone.utc).isoformat()
+    categories = [
+        {
+            "category_id": f"cat_{uuid.uuid4().hex[:12]}",
+            "user_id": user_id,
+            "name": name,
+            "section": section,
+            "is_default": True,
+            "created_at": now_iso
+        }
+        for section in ("personal", "business")
+        for name in DEFAULT_CATEGORIES
+    ]
+    await db.categories.insert_many(categories, ordered=False)
+
+
+def category_name_lookup(user_id: str, category_field: str, default: str = "Unknown"):
+    """Pipeline stages that resolve category_field to the user's category name as category_name."""
+    return [
+        {"$lookup": {
+            "from": "categories",
+            "let": {"cid": category_field},
+            "pipeline": [
+                {"$match": {"user_id": user_id, "$expr": {"$eq": ["$category_id", "$$cid"]}}},
+                {"$project": {"_id": 0, "name": 1}}
+            ],
+            "as": "cat"
+        }},
+        {"$addFields": {"category_name": {"$ifNull": [{"$arrayElemAt": ["$cat.name", 0]}, default]}}},
+        {"$project": {"cat": 0}}
+    ]
+
+
+def decode_image(image_base64: str) -> bytes:
+    if len(image_base64) > MAX_IMAGE_BASE64_LENGTH:
+        raise HTTPException(status_code=413, detail="Image too large")
+    try:
+        return base64.b64decode(image_base64, validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid image data")
 
 
 # ============= AUTH ROUTES =============
@@ -149,7 +390,7 @@ async def register(data: UserRegister):
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed = bcrypt.hashpw(data.password.encode(), bcrypt.gensalt()).decode()
+    hashed = await hash_password(data.password)
     user_id = f"user_{uuid.uuid4().hex[:12]}"
 
     user = {
@@ -166,7 +407,7 @@ async def register(data: UserRegister):
     await db.users.insert_one(user)
     await seed_default_categories(user_id)
 
-    token = await create_session(user_id)
+    token = await create_session(user_id, user)
     return {
         "token": token,
         "user": {
@@ -179,16 +420,16 @@ async def register(data: UserRegister):
 @api_router.post("/auth/login")
 async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email.lower()}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid email or password")
-
-    if not user.get("password_hash"):
+    if not user or not user.get("password_hash"):
+        await check_password(data.password, _DUMMY_HASH)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid email or password")
         raise HTTPException(status_code=401, detail="Please use Google Sign-In for this account")
 
-    if not bcrypt.checkpw(data.password.encode(), user["password_hash"].encode()):
+    if not await check_password(data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    token = await create_session(user["user_id"])
+    token = await create_session(user["user_id"], user)
     return {
         "token": token,
         "user": {
@@ -202,14 +443,13 @@ async def login(data: UserLogin):
 @api_router.post("/auth/google-session")
 async def google_session(data: GoogleAuthRequest):
     try:
-        async with httpx.AsyncClient() as http_client:
-            resp = await http_client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": data.session_id}
-            )
-            if resp.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid Google session")
-            google_data = resp.json()
+        resp = await http_client.get(
+            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+            headers={"X-Session-ID": data.session_id}
+        )
+        if resp.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid Google session")
+        google_data = resp.json()
     except httpx.HTTPError:
         raise HTTPException(status_code=500, detail="Failed to verify Google session")
 
@@ -238,8 +478,10 @@ async def google_session(data: GoogleAuthRequest):
         await db.users.insert_one(user)
         await seed_default_categories(user_id)
 
-    token = await create_session(user_id)
     user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
+    if existing:
+        await refresh_user_sessions(user_doc)
+    token = await create_session(user_id, user_doc)
     return {"token": token, "user": user_doc}
 
 
@@ -255,6 +497,11 @@ async def logout(request: Request):
     if auth_header and auth_header.startswith("Bearer "):
         token = auth_header.split("Bearer ")[1]
         await db.user_sessions.delete_one({"session_token": token})
+        try:
+            await revoke_session(token)
+        except RedisError as e:
+            logger.error(f"Session revocation failed: {e}")
+            raise HTTPException(status_code=503, detail="Logout could not be completed, please try again")
     return {"message": "Logged out"}
 
 
@@ -298,10 +545,10 @@ async def update_category(category_id: str, data: CategoryUpdate, request: Reque
 @api_router.delete("/categories/{category_id}")
 async def delete_category(category_id: str, request: Request):
     user = await get_current_user(request)
-    receipt_count = await db.receipts.count_documents(
-        {"category_id": category_id, "user_id": user["user_id"]}
-    )
-    if receipt_count > 0:
+    in_use_query = {"category_id": category_id, "user_id": user["user_id"]}
+    # find_one stops at the first match; only count when we need the number for the warning
+    if await db.receipts.find_one(in_use_query, {"_id": 1}):
+        receipt_count = await db.receipts.count_documents(in_use_query)
         return {"message": f"Warning: {receipt_count} receipts use this category", "receipt_count": receipt_count, "deleted": False}
 
     result = await db.categories.delete_one(
@@ -344,20 +591,31 @@ async def get_receipts(
     if amount_max is not None:
         query.setdefault("total", {})["$lte"] = amount_max
 
-    # Exclude image_base64 from list view for performance
-    receipts = await db.receipts.find(
-        query, {"_id": 0, "image_base64": 0}
-    ).sort("date", -1).skip(skip).limit(limit).to_list(limit)
-
-    total_count = await db.receipts.count_documents(query)
+    # List view only needs summary fields; items and notes are served by GET /receipts/{id}
+    receipts, total_count = await asyncio.gather(
+        db.receipts.find(query, RECEIPT_LIST_PROJECTION).sort("date", -1).skip(skip).limit(limit).to_list(limit),
+        get_receipt_count(user["user_id"], query)
+    )
     return {"receipts": receipts, "total": total_count}
 
 
 @api_router.post("/receipts")
 async def create_receipt(data: ReceiptCreate, request: Request):
     user = await get_current_user(request)
+    receipt_id = f"rcpt_{uuid.uuid4().hex[:12]}"
+
+    file_id = None
+    image_id = ""
+    if data.image_base64:
+        image_bytes = decode_image(data.image_base64)
+        file_id = await db_fs.upload_from_stream(
+            f"{receipt_id}.jpg", io.BytesIO(image_bytes),
+            metadata={"user_id": user["user_id"], "content_type": "image/jpeg"}
+        )
+        image_id = str(file_id)
+
     receipt = {
-        "receipt_id": f"rcpt_{uuid.uuid4().hex[:12]}",
+        "receipt_id": receipt_id,
         "user_id": user["user_id"],
         "merchant_name": data.merchant_name,
         "date": data.date,
@@ -368,20 +626,25 @@ async def create_receipt(data: ReceiptCreate, request: Request):
         "section": data.section,
         "category_id": data.category_id,
         "notes": data.notes,
-        "image_base64": data.image_base64,
+        "image_id": image_id,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.receipts.insert_one(receipt)
-    result = {k: v for k, v in receipt.items() if k not in ("_id", "image_base64")}
-    result["has_image"] = bool(data.image_base64)
-    return result
+    try:
+        await db.receipts.insert_one(receipt)
+    except Exception:
+        # Don't leave an image in GridFS that no receipt points to
+        if file_id is not None:
+            await db_fs.delete(file_id)
+        raise
+    await invalidate_receipt_counts(user["user_id"])
+    return {k: v for k, v in receipt.items() if k != "_id"}
 
 
 @api_router.get("/receipts/{receipt_id}")
 async def get_receipt(receipt_id: str, request: Request):
     user = await get_current_user(request)
     receipt = await db.receipts.find_one(
-        {"receipt_id": receipt_id, "user_id": user["user_id"]}, {"_id": 0}
+        {"receipt_id": receipt_id, "user_id": user["user_id"]}, {"_id": 0, "image_base64": 0}
     )
     if not receipt:
         raise HTTPException(status_code=404, detail="Receipt not found")
@@ -391,7 +654,7 @@ async def get_receipt(receipt_id: str, request: Request):
 @api_router.put("/receipts/{receipt_id}")
 async def update_receipt(receipt_id: str, data: ReceiptUpdate, request: Request):
     user = await get_current_user(request)
-    update_data = {k: v for k, v in data.dict(exclude_unset=True).items()}
+    update_data = data.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
 
@@ -401,43 +664,76 @@ async def update_receipt(receipt_id: str, data: ReceiptUpdate, request: Request)
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Receipt not found")
+    await invalidate_receipt_counts(user["user_id"])
     return {"message": "Receipt updated"}
 
 
 @api_router.delete("/receipts/{receipt_id}")
 async def delete_receipt(receipt_id: str, request: Request):
     user = await get_current_user(request)
-    result = await db.receipts.delete_one(
-        {"receipt_id": receipt_id, "user_id": user["user_id"]}
+    receipt = await db.receipts.find_one_and_delete(
+        {"receipt_id": receipt_id, "user_id": user["user_id"]},
+        projection={"_id": 0, "image_id": 1}
     )
-    if result.deleted_count == 0:
+    if not receipt:
         raise HTTPException(status_code=404, detail="Receipt not found")
+    await invalidate_receipt_counts(user["user_id"])
+    if receipt.get("image_id"):
+        try:
+            await db_fs.delete(ObjectId(receipt["image_id"]))
+        except NoFile:
+            pass
     return {"message": "Receipt deleted"}
 
 
+@api_router.get("/receipts/{receipt_id}/image")
+async def get_receipt_image(receipt_id: str, request: Request):
+    user = await get_current_user(request)
+    receipt = await db.receipts.find_one(
+        {"receipt_id": receipt_id, "user_id": user["user_id"]}, {"_id": 0, "image_id": 1, "image_base64": 1}
+    )
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    if not receipt.get("image_id"):
+        # Receipts saved before GridFS storage keep the image inline
+        if not receipt.get("image_base64"):
+            raise HTTPException(status_code=404, detail="Image not found")
+        try:
+            image_bytes = base64.b64decode(receipt["image_base64"])
+        except binascii.Error:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return Response(content=image_bytes, media_type="image/jpeg")
+
+    try:
+        grid_out = await db_fs.open_download_stream(ObjectId(receipt["image_id"]))
+    except (NoFile, InvalidId):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    async def read_chunks():
+        while chunk := await grid_out.readchunk():
+            yield chunk
+
+    content_type = (grid_out.metadata or {}).get("content_type", "image/jpeg")
+    return StreamingResponse(read_chunks(), media_type=content_type)
+
+
 # ============= OCR ROUTE =============
 @api_router.post("/ocr/scan")
 async def ocr_scan(data: OCRRequest, request: Request):
     await get_current_user(request)
+    # Reject oversized or malformed images before paying for the LLM call
+    decode_image(data.image_base64)
 
     llm_key = os.environ.get('EMERGENT_LLM_KEY', '')
-    if not llm_key:
+    if not llm_key or LlmChat is None:
         raise HTTPException(status_code=500, detail="OCR service not configured")
 
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
-
         chat = LlmChat(
             api_key=llm_key,
             session_id=f"ocr_{uuid.uuid4().hex[:8]}",
-            system_message=(
-                "You are a receipt OCR assistant. Extract data from receipt images and return ONLY valid JSON. "
-                "Extract: merchant_name (string), date (YYYY-MM-DD string), total (number), "
-                "tax (number, GST/HST if visible), items (array of {name: string, price: number}), "
-                "payment_method (string like 'Visa', 'Cash', 'Debit', etc). "
-                "If a field is not visible, use empty string for strings, 0 for numbers, empty array for items. "
-                "Return ONLY the JSON object, no markdown, no explanation."
-            )
+            system_message=OCR_SYSTEM_PROMPT
         ).with_model("openai", "gpt-4o")
 
         image_content = ImageContent(image_base64=data.image_base64)
@@ -448,14 +744,9 @@ async def ocr_scan(data: OCRRequest, request: Request):
         response = await chat.send_message(user_message)
 
         # Parse JSON from response
-        response_text = response.strip()
-        if response_text.startswith("```"):
-            response_text = response_text.split("\n", 1)[1] if "\n" in response_text else response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-
-        extracted = json.loads(response_text)
+        response_text = _FENCE_RE.sub("", response.strip())
+
+        extracted = orjson.loads(response_text)
         return {
             "merchant_name": extracted.get("merchant_name", ""),
             "date": extracted.get("date", ""),
@@ -465,7 +756,7 @@ async def ocr_scan(data: OCRRequest, request: Request):
             "payment_method": extracted.get("payment_method", "")
         }
 
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"OCR JSON parse error: {e}, response: {response_text[:200]}")
         return {
             "merchant_name": "", "date": "", "total": 0, "tax": 0,
@@ -488,67 +779,55 @@ async def get_dashboard_summary(request: Request):
     year_start = now.replace(month=1, day=1).strftime("%Y-%m-%d")
     today = now.strftime("%Y-%m-%d")
 
-    # Monthly total
-    monthly_pipeline = [
-        {"$match": {"user_id": user_id, "date": {"$gte": month_start, "$lte": today}}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}, "tax": {"$sum": "$tax"}, "count": {"$sum": 1}}}
-    ]
-    monthly = await db.receipts.aggregate(monthly_pipeline).to_list(1)
-    monthly_data = monthly[0] if monthly else {"total": 0, "tax": 0, "count": 0}
-
-    # Yearly total
-    yearly_pipeline = [
+    # Monthly, yearly, section and top-10 category totals in a single round-trip
+    summary_pipeline = [
         {"$match": {"user_id": user_id, "date": {"$gte": year_start, "$lte": today}}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}, "tax": {"$sum": "$tax"}, "count": {"$sum": 1}}}
+        {"$facet": {
+            "monthly": [
+                {"$match": {"date": {"$gte": month_start}}},
+                {"$group": {"_id": None, "total": {"$sum": "$total"}, "tax": {"$sum": "$tax"}, "count": {"$sum": 1}}}
+            ],
+            "yearly": [
+                {"$group": {"_id": None, "total": {"$sum": "$total"}, "tax": {"$sum": "$tax"}, "count": {"$sum": 1}}}
+            ],
+            "sections": [
+                {"$group": {"_id": "$section", "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+            ],
+            "categories": [
+                {"$group": {"_id": "$category_id", "total": {"$sum": "$total"}, "count": {"$sum": 1}}},
+                {"$sort": {"total": -1}},
+                {"$limit": 10},
+                *category_name_lookup(user_id, "$_id")
+            ]
+        }}
     ]
-    yearly = await db.receipts.aggregate(yearly_pipeline).to_list(1)
-    yearly_data = yearly[0] if yearly else {"total": 0, "tax": 0, "count": 0}
 
-    # Section breakdown
-    section_pipeline = [
-        {"$match": {"user_id": user_id, "date": {"$gte": year_start, "$lte": today}}},
-        {"$group": {"_id": "$section", "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+    # Recent receipts with category names resolved in the same query
+    recent_pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": 10},
+        {"$project": {"_id": 0, "image_base64": 0}},
+        *category_name_lookup(user_id, "$category_id", default="")
     ]
-    sections = await db.receipts.aggregate(section_pipeline).to_list(10)
-    section_data = {s["_id"]: {"total": s["total"], "count": s["count"]} for s in sections if s["_id"]}
 
-    # Category breakdown (top 10)
-    category_pipeline = [
-        {"$match": {"user_id": user_id, "date": {"$gte": year_start, "$lte": today}}},
-        {"$group": {"_id": "$category_id", "total": {"$sum": "$total"}, "count": {"$sum": 1}}},
-        {"$sort": {"total": -1}},
-        {"$limit": 10}
-    ]
-    categories = await db.receipts.aggregate(category_pipeline).to_list(10)
+    async def run_pipeline(pipeline, length):
+        return await (await db.receipts.aggregate(pipeline)).to_list(length)
 
-    # Resolve category names
-    cat_ids = [c["_id"] for c in categories if c["_id"]]
-    cat_docs = await db.categories.find(
-        {"category_id": {"$in": cat_ids}}, {"_id": 0, "category_id": 1, "name": 1}
-    ).to_list(100)
-    cat_map = {c["category_id"]: c["name"] for c in cat_docs}
+    summaries, recent = await asyncio.gather(
+        run_pipeline(summary_pipeline, 1), run_pipeline(recent_pipeline, 10)
+    )
+    summary = summaries[0]
 
+    monthly_data = summary["monthly"][0] if summary["monthly"] else {"total": 0, "tax": 0, "count": 0}
+    yearly_data = summary["yearly"][0] if summary["yearly"] else {"total": 0, "tax": 0, "count": 0}
+    section_data = {s["_id"]: {"total": s["total"], "count": s["count"]} for s in summary["sections"] if s["_id"]}
     category_data = [
-        {"category_id": c["_id"], "name": cat_map.get(c["_id"], "Unknown"),
+        {"category_id": c["_id"], "name": c["category_name"],
          "total": c["total"], "count": c["count"]}
-        for c in categories if c["_id"]
+        for c in summary["categories"] if c["_id"]
     ]
 
-    # Recent receipts
-    recent = await db.receipts.find(
-        {"user_id": user_id}, {"_id": 0, "image_base64": 0}
-    ).sort("created_at", -1).limit(10).to_list(10)
-
-    # Resolve category names for recent
-    recent_cat_ids = list(set(r.get("category_id", "") for r in recent if r.get("category_id")))
-    if recent_cat_ids:
-        recent_cats = await db.categories.find(
-            {"category_id": {"$in": recent_cat_ids}}, {"_id": 0, "category_id": 1, "name": 1}
-        ).to_list(100)
-        recent_cat_map = {c["category_id"]: c["name"] for c in recent_cats}
-        for r in recent:
-            r["category_name"] = recent_cat_map.get(r.get("category_id", ""), "")
-
     return {
         "monthly": {"total": monthly_data.get("total", 0), "tax": monthly_data.get("tax", 0), "count": monthly_data.get("count", 0)},
         "yearly": {"total": yearly_data.get("total", 0), "tax": yearly_data.get("tax", 0), "count": yearly_data.get("count", 0)},
@@ -576,42 +855,45 @@ async def get_tax_summary(
     if section:
         query["section"] = section
 
-    # By section and category
+    # Per-category breakdown and per-section totals in one round-trip
     pipeline = [
         {"$match": query},
-        {"$group": {
-            "_id": {"section": "$section", "category_id": "$category_id"},
-            "total": {"$sum": "$total"},
-            "tax": {"$sum": "$tax"},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id.section": 1, "total": -1}}
+        {"$facet": {
+            "by_cat": [
+                {"$group": {
+                    "_id": {"section": "$section", "category_id": "$category_id"},
+                    "total": {"$sum": "$total"},
+                    "tax": {"$sum": "$tax"},
+                    "count": {"$sum": 1}
+                }},
+                {"$sort": {"_id.section": 1, "total": -1}},
+                {"$limit": 200},
+                *category_name_lookup(user["user_id"], "$_id.category_id")
+            ],
+            "totals": [
+                {"$group": {"_id": "$section", "total": {"$sum": "$total"}, "tax": {"$sum": "$tax"}, "count": {"$sum": 1}}}
+            ]
+        }}
     ]
-    results = await db.receipts.aggregate(pipeline).to_list(200)
-
-    # Resolve category names
-    cat_ids = list(set(r["_id"]["category_id"] for r in results if r["_id"].get("category_id")))
-    cat_docs = await db.categories.find(
-        {"category_id": {"$in": cat_ids}}, {"_id": 0, "category_id": 1, "name": 1}
-    ).to_list(200)
-    cat_map = {c["category_id"]: c["name"] for c in cat_docs}
+    result = (await (await db.receipts.aggregate(pipeline)).to_list(1))[0]
 
     summary = {"personal": [], "business": []}
     totals = {"personal": {"total": 0, "tax": 0, "count": 0}, "business": {"total": 0, "tax": 0, "count": 0}}
 
-    for r in results:
+    for r in result["by_cat"]:
         sec = r["_id"]["section"]
         if sec in summary:
             summary[sec].append({
                 "category_id": r["_id"]["category_id"],
-                "category_name": cat_map.get(r["_id"]["category_id"], "Unknown"),
+                "category_name": r["category_name"],
                 "total": r["total"],
                 "tax": r["tax"],
                 "count": r["count"]
             })
-            totals[sec]["total"] += r["total"]
-            totals[sec]["tax"] += r["tax"]
-            totals[sec]["count"] += r["count"]
+
+    for t in result["totals"]:
+        if t["_id"] in totals:
+            totals[t["_id"]] = {"total": t["total"], "tax": t["tax"], "count": t["count"]}
 
     return {"summary": summary, "totals": totals}
 
@@ -633,31 +915,32 @@ async def export_csv(
     if section:
         query["section"] = section
 
-    receipts = await db.receipts.find(
-        query, {"_id": 0, "image_base64": 0, "user_id": 0}
-    ).sort("date", -1).to_list(10000)
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"date": -1}},
+        {"$project": {"_id": 0, "image_base64": 0, "user_id": 0}},
+        *category_name_lookup(user["user_id"], "$category_id", default="")
+    ]
 
-    # Resolve categories
-    cat_ids = list(set(r.get("category_id", "") for r in receipts if r.get("category_id")))
-    cat_docs = await db.categories.find(
-        {"category_id": {"$in": cat_ids}}, {"_id": 0, "category_id": 1, "name": 1}
-    ).to_list(500)
-    cat_map = {c["category_id"]: c["name"] for c in cat_docs}
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Date", "Merchant", "Section", "Category", "Total (CAD)", "Tax (CAD)", "Payment Method", "Notes"])
-
-    for r in receipts:
-        writer.writerow([
-            r.get("date", ""), r.get("merchant_name", ""), r.get("section", "").title(),
-            cat_map.get(r.get("category_id", ""), ""), f"{r.get('total', 0):.2f}",
-            f"{r.get('tax', 0):.2f}", r.get("payment_method", ""), r.get("notes", "")
-        ])
-
-    csv_content = output.getvalue()
-    return Response(
-        content=csv_content,
+    async def generate_rows():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["Date", "Merchant", "Section", "Category", "Total (CAD)", "Tax (CAD)", "Payment Method", "Notes"])
+        yield output.getvalue()
+
+        cursor = await db.receipts.aggregate(pipeline, batchSize=500)
+        async for r in cursor:
+            output.seek(0)
+            output.truncate(0)
+            writer.writerow([
+                r.get("date", ""), r.get("merchant_name", ""), r.get("section", "").title(),
+                r["category_name"], f"{r.get('total', 0):.2f}",
+                f"{r.get('tax', 0):.2f}", r.get("payment_method", ""), r.get("notes", "")
+            ])
+            yield output.getvalue()
+
+    return StreamingResponse(
+        generate_rows(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=billbrain_receipts_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
@@ -667,10 +950,12 @@ async def export_csv(
 @api_router.put("/settings")
 async def update_settings(data: UserSettingsUpdate, request: Request):
     user = await get_current_user(request)
-    update_data = {k: v for k, v in data.dict(exclude_unset=True).items() if v is not None}
+    update_data = data.model_dump(exclude_unset=True, exclude_none=True)
     if update_data:
         await db.users.update_one({"user_id": user["user_id"]}, {"$set": update_data})
     updated = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0, "password_hash": 0})
+    if update_data:
+        await refresh_user_sessions(updated)
     return updated
 
 
@@ -685,6 +970,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def warm_db_client():
+    # Open the pool before the first request instead of on it
+    await client.admin.command("ping")
+
+
+@app.on_event("startup")
+async def create_indexes():
+    await db.receipts.create_index([("user_id", 1), ("date", -1)])
+    await db.receipts.create_index([("user_id", 1), ("section", 1), ("date", -1)])
+    await db.receipts.create_index([("user_id", 1), ("category_id", 1)])
+    await db.receipts.create_index([("user_id", 1), ("total", 1)])
+    await db.receipts.create_index([("user_id", 1), ("created_at", -1)])
+    await db.receipts.create_index("receipt_id")
+    await db.user_sessions.create_index("session_token", unique=True)
+    # TTL index: Mongo removes sessions once expires_at has passed
+    await db.user_sessions.create_index("expires_at", expireAfterSeconds=0)
+    await db.users.create_index("user_id")
+    await db.users.create_index("email")
+    await db.categories.create_index([("user_id", 1), ("category_id", 1)])
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await client.close()
+    await redis_client.aclose()
+    await http_client.aclose()
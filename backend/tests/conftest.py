@@ -1,6 +1,9 @@
 import pytest
-import requests
+import httpx
 import os
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 @pytest.fixture(scope="session")
 def base_url():
@@ -9,8 +12,76 @@ def base_url():
         pytest.fail("EXPO_PUBLIC_BACKEND_URL environment variable not set")
     return url.rstrip('/')
 
+# pid keeps xdist workers apart; the start time keeps reruns from reusing a recycled pid
+_run_id = f"{os.getpid()}_{int(time.time())}"
+_email_seq = itertools.count()
+
+def unique_email():
+    return f"test_{_run_id}_{next(_email_seq)}@example.com"
+
+def _new_client():
+    # HTTP/2 multiplexes concurrent requests (e.g. receipt seeding) over one connection
+    return httpx.Client(
+        http2=True, timeout=30.0,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        headers={"Content-Type": "application/json"}
+    )
+
+def _register(client, base_url):
+    payload = {
+        "email": unique_email(),
+        "password": "TestPass123!",
+        "name": "Test User"
+    }
+    response = client.post(f"{base_url}/api/auth/register", json=payload)
+    client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+
 @pytest.fixture
 def api_client():
-    session = requests.Session()
-    session.headers.update({"Content-Type": "application/json"})
-    return session
+    client = _new_client()
+    yield client
+    client.close()
+
+@pytest.fixture(scope="module")
+def authenticated_client(base_url):
+    """Client for a user registered once per module"""
+    client = _new_client()
+    _register(client, base_url)
+    yield client
+    client.close()
+
+@pytest.fixture(scope="module")
+def default_category_id(authenticated_client, base_url):
+    """First default category of the module's authenticated user"""
+    response = authenticated_client.get(f"{base_url}/api/categories")
+    return response.json()[0]["category_id"]
+
+@pytest.fixture(scope="module")
+def custom_category_response(authenticated_client, base_url):
+    """Create response for one custom category shared by the create/update/delete tests, which run in that order"""
+    payload = {"name": "Custom Test Category", "section": "personal"}
+    return authenticated_client.post(f"{base_url}/api/categories", json=payload)
+
+@pytest.fixture(scope="module")
+def authenticated_client_with_data(authenticated_client, default_category_id, base_url):
+    """The module's authenticated client with sample receipts added"""
+    payloads = [
+        {
+            "merchant_name": f"Store {i}",
+            "date": "2026-01-15",
+            "total": 100.00 + i * 10,
+            "tax": 13.00,
+            "items": [],
+            "payment_method": "Visa",
+            "section": "personal" if i % 2 == 0 else "business",
+            "category_id": default_category_id,
+            "notes": "",
+            "image_base64": ""
+        }
+        for i in range(3)
+    ]
+    with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+        responses = list(executor.map(lambda p: authenticated_client.post(f"{base_url}/api/receipts", json=p), payloads))
+    assert all(r.status_code == 200 for r in responses), [(r.status_code, r.text[:200]) for r in responses]
+
+    return authenticated_client
@@ -1,9 +1,9 @@
-import pytest
-import requests
 import os
-import uuid
+import base64
 from datetime import datetime
 
+from conftest import unique_email
+
 BASE_URL = os.environ.get('EXPO_PUBLIC_BACKEND_URL').rstrip('/')
 
 class TestAuthFlow:
@@ -11,7 +11,7 @@ class TestAuthFlow:
     
     def test_register_new_user(self, api_client):
         """Test user registration creates user and returns token"""
-        email = f"test_{uuid.uuid4().hex[:8]}@example.com"
+        email = unique_email()
         payload = {
             "email": email,
             "password": "TestPass123!",
@@ -19,7 +19,6 @@ class TestAuthFlow:
         }
         
         response = api_client.post(f"{BASE_URL}/api/auth/register", json=payload)
-        print(f"Register response status: {response.status_code}")
         
         assert response.status_code == 200, f"Expected 200, got {response.status_code}"
         
@@ -33,15 +32,14 @@ class TestAuthFlow:
         # Verify user can authenticate with token
         api_client.headers["Authorization"] = f"Bearer {data['token']}"
         me_response = api_client.get(f"{BASE_URL}/api/auth/me")
-        assert me_response.status_code == 200
+        assert me_response.status_code == 200, f"status={me_response.status_code} body={me_response.text[:200]}"
         me_data = me_response.json()
         assert me_data["email"] == email.lower()
-        print("✓ User registration and token verification successful")
     
     def test_login_with_credentials(self, api_client):
         """Test login with email and password"""
         # First register a user
-        email = f"test_{uuid.uuid4().hex[:8]}@example.com"
+        email = unique_email()
         register_payload = {
             "email": email,
             "password": "LoginTest123!",
@@ -55,14 +53,12 @@ class TestAuthFlow:
             "password": "LoginTest123!"
         }
         response = api_client.post(f"{BASE_URL}/api/auth/login", json=login_payload)
-        print(f"Login response status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         assert "token" in data
         assert "user" in data
         assert data["user"]["email"] == email.lower()
-        print("✓ Login successful")
     
     def test_login_invalid_credentials(self, api_client):
         """Test login fails with invalid password"""
@@ -71,41 +67,43 @@ class TestAuthFlow:
             "password": "wrongpassword"
         }
         response = api_client.post(f"{BASE_URL}/api/auth/login", json=payload)
-        print(f"Invalid login response status: {response.status_code}")
-        assert response.status_code == 401
-        print("✓ Invalid credentials rejected correctly")
+        assert response.status_code == 401, f"status={response.status_code} body={response.text[:200]}"
     
     def test_auth_me_requires_token(self, api_client):
         """Test /auth/me requires authentication"""
         response = api_client.get(f"{BASE_URL}/api/auth/me")
-        print(f"Auth/me without token status: {response.status_code}")
-        assert response.status_code == 401
-        print("✓ Auth/me correctly requires token")
+        assert response.status_code == 401, f"status={response.status_code} body={response.text[:200]}"
+    
+    def test_logout_revokes_token(self, api_client):
+        """Test a token stops working after logout, even once it has been cached"""
+        payload = {
+            "email": unique_email(),
+            "password": "LogoutTest123!",
+            "name": "Logout Test"
+        }
+        register_response = api_client.post(f"{BASE_URL}/api/auth/register", json=payload)
+        assert register_response.status_code == 200, f"status={register_response.status_code} body={register_response.text[:200]}"
+        api_client.headers["Authorization"] = f"Bearer {register_response.json()['token']}"
+        
+        # Authenticate once so the session is cached
+        me_response = api_client.get(f"{BASE_URL}/api/auth/me")
+        assert me_response.status_code == 200, f"status={me_response.status_code} body={me_response.text[:200]}"
+        
+        response = api_client.post(f"{BASE_URL}/api/auth/logout")
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
+        
+        me_response = api_client.get(f"{BASE_URL}/api/auth/me")
+        assert me_response.status_code == 401, f"status={me_response.status_code} body={me_response.text[:200]}"
 
 
 class TestCategoriesFlow:
     """Test category endpoints"""
     
-    @pytest.fixture
-    def authenticated_client(self, api_client):
-        """Create authenticated client with test user"""
-        email = f"test_{uuid.uuid4().hex[:8]}@example.com"
-        payload = {
-            "email": email,
-            "password": "TestPass123!",
-            "name": "Test User"
-        }
-        response = api_client.post(f"{BASE_URL}/api/auth/register", json=payload)
-        token = response.json()["token"]
-        api_client.headers["Authorization"] = f"Bearer {token}"
-        return api_client
-    
     def test_get_default_categories(self, authenticated_client):
         """Test that 28 default categories are created (14 per section)"""
         response = authenticated_client.get(f"{BASE_URL}/api/categories")
-        print(f"Get categories response status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         categories = response.json()
         
         assert isinstance(categories, list), "Categories should be a list"
@@ -124,19 +122,12 @@ class TestCategoriesFlow:
             assert "section" in cat
             assert "is_default" in cat
             assert "_id" not in cat, "MongoDB _id should not be present"
-        
-        print(f"✓ Default categories verified: {len(personal_cats)} personal, {len(business_cats)} business")
     
-    def test_create_custom_category(self, authenticated_client):
+    def test_create_custom_category(self, authenticated_client, custom_category_response):
         """Test creating a custom category"""
-        payload = {
-            "name": "Custom Test Category",
-            "section": "personal"
-        }
-        response = authenticated_client.post(f"{BASE_URL}/api/categories", json=payload)
-        print(f"Create category response status: {response.status_code}")
+        response = custom_category_response
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         assert data["name"] == "Custom Test Category"
         assert data["section"] == "personal"
@@ -147,21 +138,16 @@ class TestCategoriesFlow:
         get_response = authenticated_client.get(f"{BASE_URL}/api/categories")
         categories = get_response.json()
         assert any(c["category_id"] == data["category_id"] for c in categories)
-        print("✓ Custom category created and persisted")
     
-    def test_update_category_name(self, authenticated_client):
+    def test_update_category_name(self, authenticated_client, custom_category_response):
         """Test updating category name"""
-        # Create category first
-        create_payload = {"name": "Original Name", "section": "business"}
-        create_response = authenticated_client.post(f"{BASE_URL}/api/categories", json=create_payload)
-        category_id = create_response.json()["category_id"]
+        category_id = custom_category_response.json()["category_id"]
         
         # Update it
         update_payload = {"name": "Updated Name"}
         response = authenticated_client.put(f"{BASE_URL}/api/categories/{category_id}", json=update_payload)
-        print(f"Update category response status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         
         # Verify update persisted
         get_response = authenticated_client.get(f"{BASE_URL}/api/categories")
@@ -169,20 +155,15 @@ class TestCategoriesFlow:
         updated_cat = next((c for c in categories if c["category_id"] == category_id), None)
         assert updated_cat is not None
         assert updated_cat["name"] == "Updated Name"
-        print("✓ Category update verified")
     
-    def test_delete_category(self, authenticated_client):
+    def test_delete_category(self, authenticated_client, custom_category_response):
         """Test deleting a category"""
-        # Create category
-        create_payload = {"name": "To Delete", "section": "personal"}
-        create_response = authenticated_client.post(f"{BASE_URL}/api/categories", json=create_payload)
-        category_id = create_response.json()["category_id"]
+        category_id = custom_category_response.json()["category_id"]
         
         # Delete it
         response = authenticated_client.delete(f"{BASE_URL}/api/categories/{category_id}")
-        print(f"Delete category response status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         assert data["deleted"] == True
         
@@ -190,33 +171,13 @@ class TestCategoriesFlow:
         get_response = authenticated_client.get(f"{BASE_URL}/api/categories")
         categories = get_response.json()
         assert not any(c["category_id"] == category_id for c in categories)
-        print("✓ Category deleted successfully")
 
 
 class TestReceiptsFlow:
     """Test receipt endpoints"""
     
-    @pytest.fixture
-    def authenticated_client(self, api_client):
-        """Create authenticated client with test user and get a category"""
-        email = f"test_{uuid.uuid4().hex[:8]}@example.com"
-        payload = {
-            "email": email,
-            "password": "TestPass123!",
-            "name": "Test User"
-        }
-        response = api_client.post(f"{BASE_URL}/api/auth/register", json=payload)
-        token = response.json()["token"]
-        api_client.headers["Authorization"] = f"Bearer {token}"
-        return api_client
-    
-    def test_create_receipt(self, authenticated_client):
+    def test_create_receipt(self, authenticated_client, default_category_id):
         """Test creating a receipt"""
-        # Get a category first
-        cats_response = authenticated_client.get(f"{BASE_URL}/api/categories")
-        categories = cats_response.json()
-        category_id = categories[0]["category_id"]
-        
         payload = {
             "merchant_name": "Test Store",
             "date": "2026-01-15",
@@ -225,15 +186,14 @@ class TestReceiptsFlow:
             "items": [{"name": "Item 1", "price": 87.00}],
             "payment_method": "Visa",
             "section": "personal",
-            "category_id": category_id,
+            "category_id": default_category_id,
             "notes": "Test receipt",
             "image_base64": ""
         }
         
         response = authenticated_client.post(f"{BASE_URL}/api/receipts", json=payload)
-        print(f"Create receipt response status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         assert data["merchant_name"] == "Test Store"
         assert data["total"] == 99.99
@@ -244,17 +204,12 @@ class TestReceiptsFlow:
         # Verify persistence
         receipt_id = data["receipt_id"]
         get_response = authenticated_client.get(f"{BASE_URL}/api/receipts/{receipt_id}")
-        assert get_response.status_code == 200
+        assert get_response.status_code == 200, f"status={get_response.status_code} body={get_response.text[:200]}"
         fetched = get_response.json()
         assert fetched["merchant_name"] == "Test Store"
-        print("✓ Receipt created and persisted")
     
-    def test_get_receipts_with_filters(self, authenticated_client):
+    def test_get_receipts_with_filters(self, authenticated_client, default_category_id):
         """Test receipt list with section filter"""
-        # Create receipts
-        cats_response = authenticated_client.get(f"{BASE_URL}/api/categories")
-        category_id = cats_response.json()[0]["category_id"]
-        
         # Personal receipt
         personal_payload = {
             "merchant_name": "Personal Store",
@@ -264,7 +219,7 @@ class TestReceiptsFlow:
             "items": [],
             "payment_method": "Cash",
             "section": "personal",
-            "category_id": category_id,
+            "category_id": default_category_id,
             "notes": "",
             "image_base64": ""
         }
@@ -278,23 +233,17 @@ class TestReceiptsFlow:
         
         # Test section filter
         response = authenticated_client.get(f"{BASE_URL}/api/receipts?section=personal")
-        print(f"Get receipts with filter status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         assert "receipts" in data
         assert "total" in data
         receipts = data["receipts"]
-        personal_receipts = [r for r in receipts if r["section"] == "personal"]
-        assert len(personal_receipts) > 0
-        print("✓ Receipt filters working")
+        assert len(receipts) >= 1 and all(r["section"] == "personal" for r in receipts)
     
-    def test_delete_receipt(self, authenticated_client):
+    def test_delete_receipt(self, authenticated_client, default_category_id):
         """Test deleting a receipt"""
         # Create receipt
-        cats_response = authenticated_client.get(f"{BASE_URL}/api/categories")
-        category_id = cats_response.json()[0]["category_id"]
-        
         payload = {
             "merchant_name": "To Delete",
             "date": "2026-01-15",
@@ -303,7 +252,7 @@ class TestReceiptsFlow:
             "items": [],
             "payment_method": "Cash",
             "section": "personal",
-            "category_id": category_id,
+            "category_id": default_category_id,
             "notes": "",
             "image_base64": ""
         }
@@ -312,59 +261,71 @@ class TestReceiptsFlow:
         
         # Delete it
         response = authenticated_client.delete(f"{BASE_URL}/api/receipts/{receipt_id}")
-        print(f"Delete receipt response status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         
         # Verify it's gone
         get_response = authenticated_client.get(f"{BASE_URL}/api/receipts/{receipt_id}")
-        assert get_response.status_code == 404
-        print("✓ Receipt deleted successfully")
+        assert get_response.status_code == 404, f"status={get_response.status_code} body={get_response.text[:200]}"
+    
+    def test_receipt_image_roundtrip(self, authenticated_client, default_category_id):
+        """Test receipt image is stored, served back, and removed with the receipt"""
+        image_bytes = b"\xff\xd8\xff\xe0BillBrain test image\xff\xd9"
+        payload = {
+            "merchant_name": "Image Store",
+            "date": "2026-01-15",
+            "total": 20.00,
+            "tax": 2.00,
+            "items": [],
+            "payment_method": "Visa",
+            "section": "personal",
+            "category_id": default_category_id,
+            "notes": "",
+            "image_base64": base64.b64encode(image_bytes).decode()
+        }
+        create_response = authenticated_client.post(f"{BASE_URL}/api/receipts", json=payload)
+        assert create_response.status_code == 200, f"status={create_response.status_code} body={create_response.text[:200]}"
+        data = create_response.json()
+        assert data["image_id"]
+        receipt_id = data["receipt_id"]
+        
+        # Verify the stored bytes are served back
+        image_response = authenticated_client.get(f"{BASE_URL}/api/receipts/{receipt_id}/image")
+        assert image_response.status_code == 200, f"status={image_response.status_code} body={image_response.text[:200]}"
+        assert image_response.content == image_bytes
+        
+        # Verify the image goes away with the receipt
+        delete_response = authenticated_client.delete(f"{BASE_URL}/api/receipts/{receipt_id}")
+        assert delete_response.status_code == 200, f"status={delete_response.status_code} body={delete_response.text[:200]}"
+        image_response = authenticated_client.get(f"{BASE_URL}/api/receipts/{receipt_id}/image")
+        assert image_response.status_code == 404, f"status={image_response.status_code} body={image_response.text[:200]}"
+    
+    def test_create_receipt_rejects_invalid_image(self, authenticated_client, default_category_id):
+        """Test receipt creation rejects malformed base64 image data"""
+        payload = {
+            "merchant_name": "Bad Image Store",
+            "date": "2026-01-15",
+            "total": 5.00,
+            "tax": 0.50,
+            "items": [],
+            "payment_method": "Cash",
+            "section": "personal",
+            "category_id": default_category_id,
+            "notes": "",
+            "image_base64": "not base64!"
+        }
+        response = authenticated_client.post(f"{BASE_URL}/api/receipts", json=payload)
+        assert response.status_code == 400, f"status={response.status_code} body={response.text[:200]}"
 
 
 class TestDashboardAndReports:
     """Test dashboard and report endpoints"""
     
-    @pytest.fixture
-    def authenticated_client_with_data(self, api_client):
-        """Create user with sample receipts"""
-        email = f"test_{uuid.uuid4().hex[:8]}@example.com"
-        payload = {
-            "email": email,
-            "password": "TestPass123!",
-            "name": "Test User"
-        }
-        response = api_client.post(f"{BASE_URL}/api/auth/register", json=payload)
-        token = response.json()["token"]
-        api_client.headers["Authorization"] = f"Bearer {token}"
-        
-        # Create sample receipts
-        cats_response = api_client.get(f"{BASE_URL}/api/categories")
-        category_id = cats_response.json()[0]["category_id"]
-        
-        for i in range(3):
-            receipt_payload = {
-                "merchant_name": f"Store {i}",
-                "date": "2026-01-15",
-                "total": 100.00 + i * 10,
-                "tax": 13.00,
-                "items": [],
-                "payment_method": "Visa",
-                "section": "personal" if i % 2 == 0 else "business",
-                "category_id": category_id,
-                "notes": "",
-                "image_base64": ""
-            }
-            api_client.post(f"{BASE_URL}/api/receipts", json=receipt_payload)
-        
-        return api_client
-    
     def test_dashboard_summary(self, authenticated_client_with_data):
         """Test dashboard summary returns all required data"""
         response = authenticated_client_with_data.get(f"{BASE_URL}/api/dashboard/summary")
-        print(f"Dashboard summary status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         
         # Check structure
@@ -381,32 +342,27 @@ class TestDashboardAndReports:
         
         # Check recent receipts
         assert isinstance(data["recent_receipts"], list)
-        print(f"✓ Dashboard summary returned with {data['monthly']['count']} monthly receipts")
     
     def test_tax_summary_report(self, authenticated_client_with_data):
         """Test tax summary report"""
         response = authenticated_client_with_data.get(f"{BASE_URL}/api/reports/tax-summary")
-        print(f"Tax summary status: {response.status_code}")
         
-        assert response.status_code == 200
+        assert response.status_code == 200, f"status={response.status_code} body={response.text[:200]}"
         data = response.json()
         
         assert "summary" in data
         assert "totals" in data
         assert "personal" in data["summary"]
         assert "business" in data["summary"]
-        print("✓ Tax summary report generated")
     
     def test_csv_export(self, authenticated_client_with_data):
         """Test CSV export"""
-        response = authenticated_client_with_data.get(f"{BASE_URL}/api/reports/export-csv")
-        print(f"CSV export status: {response.status_code}")
-        
-        assert response.status_code == 200
-        assert 'text/csv' in response.headers.get('Content-Type', '')
-        
-        csv_content = response.text
-        assert "Date" in csv_content
-        assert "Merchant" in csv_content
-        assert "Total (CAD)" in csv_content
-        print("✓ CSV export successful")
+        with authenticated_client_with_data.stream("GET", f"{BASE_URL}/api/reports/export-csv") as response:
+            assert response.status_code == 200, f"status={response.status_code}"
+            assert 'text/csv' in response.headers.get('Content-Type', '')
+            
+            # The header row is the first thing streamed; no need to read the rest
+            first_chunk = next(response.iter_bytes(chunk_size=4096)).decode("utf-8", errors="ignore")
+        assert "Date" in first_chunk
+        assert "Merchant" in first_chunk
+        assert "Total (CAD)" in first_chunk
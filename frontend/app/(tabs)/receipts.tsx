@@ -18,7 +18,7 @@ type Receipt = {
   category_id: string;
   category_name?: string;
   payment_method: string;
-  has_image?: boolean;
+  image_id?: string;
 };
 
 const SECTIONS = ['all', 'personal', 'business'];